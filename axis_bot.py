@@ -9,11 +9,19 @@ Run:
 """
 
 import os
-import json
+import io
+import html
 import math
-from datetime import datetime, timedelta
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+import orjson
+from numba import njit
 
 from dotenv import load_dotenv
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
@@ -22,7 +30,8 @@ from telegram.ext import (
     ConversationHandler, ContextTypes, filters
 )
 
-from sweet_spots import save_log, recalculate_all_sweet_spots, get_sweet_spots
+from config import DATA_DIR
+from sweet_spots import save_log, recalculate_all_sweet_spots, get_sweet_spots, migrate_legacy_log
 
 def on_all_inputs_received(user_id, mood, sleep, activity, focus, social):
     # 1) зберігаємо лог
@@ -38,8 +47,7 @@ def on_all_inputs_received(user_id, mood, sleep, activity, focus, social):
 
 
 # ---------------------- Config ----------------------
-DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
-DATA_DIR.mkdir(exist_ok=True, parents=True)
+# DATA_DIR is shared with sweet_spots (see config.py)
 
 # Model hyperparams (MVP defaults)
 ALPHA = 0.7   # Mood = ALPHA * M_eff + (1-ALPHA) * M_hat
@@ -51,8 +59,14 @@ W_F = 0.30  # focus
 W_A = 0.20  # activity
 W_SC = 0.15 # social
 
-# Lag weights (today, yesterday, 2 days ago)
-LAG_WEIGHTS = [0.6, 0.3, 0.1]
+# Lag weights (today, yesterday, 2 days ago); must sum to 1.0, see with_lag
+LAG_WEIGHTS = (0.6, 0.3, 0.1)
+assert math.fsum(LAG_WEIGHTS) == 1.0, "LAG_WEIGHTS must sum to 1.0"
+
+# Factor order used by the numeric scoring kernel
+XKEYS = ["sleep", "activity", "focus", "social"]
+# Stability weights in XKEYS order
+_W = np.array([W_S, W_A, W_F, W_SC])
 
 # Defaults for "sweet spots" when not enough data
 DEFAULTS = {
@@ -69,132 +83,201 @@ def user_file(user_id: int) -> Path:
 def load_user(user_id: int) -> Dict[str, Any]:
     f = user_file(user_id)
     if f.exists():
-        return json.loads(f.read_text())
+        data = orjson.loads(f.read_bytes())
+        # in memory each entry also carries "_date" (datetime.date), parsed once here
+        for e in data["entries"]:
+            e["_date"] = date.fromisoformat(e["date"])
+        return data
     return {"entries": []}  # list of {date: "YYYY-MM-DD", mood, sleep, activity, focus, social}
 
+def dump_user(data: Dict[str, Any], option: int = orjson.OPT_INDENT_2) -> bytes:
+    # on-disk / exported shape: in-memory "_date" is dropped
+    entries = [{k: v for k, v in e.items() if k != "_date"} for e in data["entries"]]
+    return orjson.dumps({**data, "entries": entries}, option=option)
+
 def save_user(user_id: int, data: Dict[str, Any]) -> None:
-    user_file(user_id).write_text(json.dumps(data, ensure_ascii=False, indent=2))
+    user_file(user_id).write_bytes(dump_user(data, orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
-def today_str() -> str:
-    return datetime.now().strftime("%Y-%m-%d")
+def _recent_dates(day: date, n: int) -> List[date]:
+    # [day, day-1, ..., day-(n-1)]
+    return [day - timedelta(days=d) for d in range(n)]
 
-def get_entry(entries: List[Dict[str, Any]], date_str: str) -> Dict[str, Any]:
+def get_entry(entries: List[Dict[str, Any]], day: date) -> Dict[str, Any]:
     for e in entries:
-        if e["date"] == date_str:
+        if e["_date"] == day:
             return e
-    e = {"date": date_str}
+    e = {"date": day.isoformat(), "_date": day}
     entries.append(e)
     return e
 
-def get_past_entries(entries: List[Dict[str, Any]], days_back: int) -> List[Dict[str, Any]]:
-    target_dates = [(datetime.now() - timedelta(days=d)).strftime("%Y-%m-%d") for d in range(days_back)]
-    return [e for e in entries if e["date"] in target_dates]
+def index_by_date(entries: List[Dict[str, Any]]) -> Dict[date, Dict[str, Any]]:
+    return {e["_date"]: e for e in entries}
+
+def get_past_entries(entries: List[Dict[str, Any]], days_back: int,
+                     day: Optional[date] = None) -> List[Dict[str, Any]]:
+    target_dates = set(_recent_dates(day or date.today(), days_back))
+    return [e for e in entries if e["_date"] in target_dates]
+
+# --------------- Caches ---------------
+# Keyed by user_id + history_fingerprint(entries): any /log appends an entry
+# or rewrites today's ts, so stale keys are never hit.
+SCORE_CACHE_SIZE = 4096    # daily Life Scores: (user_id, date, *fingerprint)
+DERIVED_CACHE_SIZE = 1024  # per-factor optimal/tolerance: (user_id, *fingerprint)
+_SCORE_CACHE: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_DERIVED_CACHE: "OrderedDict[tuple, Dict[str, Dict[str, float]]]" = OrderedDict()
+# handlers compute scores in worker threads (asyncio.to_thread)
+_CACHE_LOCK = threading.Lock()
+
+def _memo(cache: OrderedDict, key: tuple, maxsize: int, compute):
+    # tiny bounded LRU over an OrderedDict
+    with _CACHE_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    value = compute()
+    with _CACHE_LOCK:
+        cache[key] = value
+        if len(cache) > maxsize:
+            cache.popitem(last=False)
+    return value
+
+def history_fingerprint(entries: List[Dict[str, Any]]) -> tuple:
+    return (len(entries), entries[-1].get("ts") if entries else None)
 
 # --------------- Normalization & Model ---------------
+# Numeric helpers are compiled with numba so _score_kernel runs as native code.
+@njit(cache=True)
 def clamp(x: float, lo: float, hi: float) -> float:
     return max(lo, min(hi, x))
 
+@njit(cache=True)
 def normalize_from_optimal(actual: float, optimal: float, tolerance: float) -> float:
     if tolerance <= 0:
         return 0.0
     val = 1.0 - abs(actual - optimal) / tolerance
-    return clamp(val, 0.0, 1.0)
+    # inline clamp to [0, 1]; compiles to plain minsd/maxsd
+    return min(max(val, 0.0), 1.0)
+
+@njit(cache=True)
+def with_lag(values: np.ndarray) -> float:
+    # values: [today, yesterday, 2days]; weights sum to 1.0, so no normalization needed
+    return values[0] * LAG_WEIGHTS[0] + values[1] * LAG_WEIGHTS[1] + values[2] * LAG_WEIGHTS[2]
 
-def with_lag(values: List[float]) -> float:
-    # values: [today, yesterday, 2days]
-    total = 0.0
-    weight_sum = 0.0
-    for v, w in zip(values, LAG_WEIGHTS):
-        total += v * w
-        weight_sum += w
-    return total / weight_sum if weight_sum > 0 else 0.0
+def _median(a: List[float]) -> float:
+    s = sorted(a)
+    mid = len(s) // 2
+    return s[mid] if len(s) % 2 == 1 else (s[mid - 1] + s[mid]) / 2
 
 def derive_optimal_from_history(history: List[Dict[str, Any]], key: str, window: int = 14) -> Dict[str, float]:
     # Naive: optimal = mean of last 'window' values where mood >= user's median mood
     if not history:
         d = DEFAULTS[key]
         return {"optimal": d["optimal"], "tolerance": d["tolerance"]}
-    recent = sorted(history, key=lambda e: e["date"], reverse=True)[:window]
-    vals = [e.get(key) for e in recent if key in e and isinstance(e.get(key), (int, float))]
-    moods = [e.get("mood") for e in recent if "mood" in e and isinstance(e.get("mood"), (int, float))]
-    if len(vals) < 5 or len(moods) < 5:
+    recent = sorted(history, key=lambda e: e["_date"], reverse=True)[:window]
+    # single pass: Welford running mean/variance of values + moods and (value, mood) pairs
+    n, mean, m2 = 0, 0.0, 0.0
+    moods, pairs = [], []
+    for e in recent:
+        v, m = e.get(key), e.get("mood")
+        has_val = isinstance(v, (int, float))
+        if has_val:
+            n += 1
+            delta = v - mean
+            mean += delta / n
+            m2 += delta * (v - mean)
+        if isinstance(m, (int, float)):
+            moods.append(m)
+            if has_val:
+                pairs.append((v, m))
+    if n < 5 or len(moods) < 5:
         d = DEFAULTS[key]
         return {"optimal": d["optimal"], "tolerance": d["tolerance"]}
-    # median mood
-    smoods = sorted(moods)
-    mid = len(smoods)//2
-    median_mood = (smoods[mid] if len(smoods)%2==1 else (smoods[mid-1]+smoods[mid])/2)
+    median_mood = _median(moods)
     # take values on days with mood >= median
-    good_vals = [e.get(key) for e in recent if "mood" in e and e["mood"] >= median_mood and key in e]
+    good_vals = [v for v, m in pairs if m >= median_mood]
     if not good_vals:
         d = DEFAULTS[key]
         return {"optimal": d["optimal"], "tolerance": d["tolerance"]}
     optimal = sum(good_vals)/len(good_vals)
     # tolerance as (max(1.5, std dev)) fallback
-    mean = sum(vals)/len(vals)
-    variance = sum((x-mean)**2 for x in vals)/len(vals)
-    std = math.sqrt(variance)
+    std = math.sqrt(m2 / n)
     tolerance = max(1.5, std if std>0 else 2.0)
     return {"optimal": optimal, "tolerance": tolerance}
 
-def compute_stability(history: List[Dict[str, Any]]) -> Dict[str, Any]:
-    # gather today's and past two days' values per factor
-    today = datetime.now().strftime("%Y-%m-%d")
-    xkeys = ["sleep", "activity", "focus", "social"]
-    # get three day values (today, yesterday, 2days)
-    triple = []
-    for d in range(3):
-        ds = (datetime.now() - timedelta(days=d)).strftime("%Y-%m-%d")
-        entry = next((e for e in history if e["date"] == ds), None)
-        triple.append(entry)
-    # derive optimal/tolerance per factor from last 14 days
-    derived = {k: derive_optimal_from_history(history, k, window=14) for k in xkeys}
-    # normalize with optimal/tolerance per day and then apply lag
-    effs = {}
-    for k in xkeys:
-        per_day_norm = []
-        for entry in triple:
-            if entry is None or k not in entry:
-                per_day_norm.append(0.0)  # missing data counts as 0 (can refine later)
-            else:
-                a = float(entry[k])
-                opt = derived[k]["optimal"]
-                tol = derived[k]["tolerance"]
-                per_day_norm.append(normalize_from_optimal(a, opt, tol))
-        effs[k] = with_lag(per_day_norm)
-    stability = (
-        W_S * effs["sleep"] +
-        W_F * effs["focus"] +
-        W_A * effs["activity"] +
-        W_SC * effs["social"]
-    )
-    return {"value": stability, "components": effs, "optimal": derived}
-
+@njit(cache=True)
 def compute_m_hat(stability_value: float) -> float:
     # MVP simplification: use stability as a proxy for predicted mood
     return stability_value
 
+@njit(cache=True)
 def normalize_mood(mood_1_10: float) -> float:
     # map 1..10 to 0..1
     return (float(mood_1_10) - 1.0) / 9.0
 
-def compute_life_score(entry_date: str, history: List[Dict[str, Any]]) -> Dict[str, Any]:
-    # Use latest 3 days around entry_date (assuming entry_date is today in MVP)
-    stability = compute_stability(history)
-    # mood effective with lag (if we have past values)
-    # We'll compute lagged mood from normalized mood on the last 3 days
-    moods = []
+@njit(cache=True)
+def _score_kernel(triple_vals: np.ndarray, opt: np.ndarray, tol: np.ndarray, moods: np.ndarray):
+    # triple_vals[k, d]: factor XKEYS[k] on day d (today, yesterday, 2days); NaN = missing
+    # moods[d]: raw 1..10 mood on day d; NaN = missing
+    effs = np.zeros(4)
+    per_day = np.zeros(3)
+    for k in range(4):
+        for d in range(3):
+            a = triple_vals[k, d]
+            # missing data counts as 0 (can refine later)
+            per_day[d] = 0.0 if np.isnan(a) else normalize_from_optimal(a, opt[k], tol[k])
+        effs[k] = with_lag(per_day)
+    # weighted sum over factors; np.sum instead of np.dot, which needs SciPy BLAS under numba
+    stability = np.sum(_W * effs)
     for d in range(3):
-        ds = (datetime.now() - timedelta(days=d)).strftime("%Y-%m-%d")
-        entry = next((e for e in history if e["date"] == ds), None)
-        if entry and "mood" in entry:
-            moods.append(normalize_mood(entry["mood"]))
-        else:
-            moods.append(0.0)
-    m_eff = with_lag(moods)
-    m_hat = compute_m_hat(stability["value"])
-    mood = ALPHA * m_eff + (1-ALPHA) * m_hat
-    life_raw = BETA * mood + (1 - BETA) * stability["value"]
+        per_day[d] = 0.0 if np.isnan(moods[d]) else normalize_mood(moods[d])
+    m_eff = with_lag(per_day)
+    m_hat = compute_m_hat(stability)
+    mood = ALPHA * m_eff + (1 - ALPHA) * m_hat
+    life_raw = BETA * mood + (1 - BETA) * stability
+    return life_raw, stability, mood, m_eff, m_hat, effs
+
+def derive_all_optimal(history: List[Dict[str, Any]], user_id: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+    # derive optimal/tolerance per factor from last 14 days; memoized per user and history state
+    def compute():
+        return {k: derive_optimal_from_history(history, k, window=14) for k in XKEYS}
+    if user_id is None:
+        return compute()
+    key = (user_id,) + history_fingerprint(history)
+    return _memo(_DERIVED_CACHE, key, DERIVED_CACHE_SIZE, compute)
+
+def _score(history: List[Dict[str, Any]], by_date: Dict[date, Dict[str, Any]], day: date,
+           user_id: Optional[int] = None):
+    # get three day entries (day, day before, 2 days before)
+    triple = [by_date.get(d) for d in _recent_dates(day, 3)]
+    derived = derive_all_optimal(history, user_id)
+    triple_vals = np.array([
+        [float(e[k]) if e is not None and k in e else np.nan for e in triple]
+        for k in XKEYS
+    ])
+    opt = np.array([derived[k]["optimal"] for k in XKEYS], dtype=np.float64)
+    tol = np.array([derived[k]["tolerance"] for k in XKEYS], dtype=np.float64)
+    moods = np.array([float(e["mood"]) if e and "mood" in e else np.nan for e in triple])
+    life_raw, stability, mood, m_eff, m_hat, effs = _score_kernel(triple_vals, opt, tol, moods)
+    stability = {
+        "value": stability,
+        "components": {k: float(effs[i]) for i, k in enumerate(XKEYS)},
+        "optimal": derived
+    }
+    return life_raw, stability, mood, m_eff, m_hat
+
+def compute_stability(history: List[Dict[str, Any]], by_date: Optional[Dict[date, Dict[str, Any]]] = None,
+                      day: Optional[date] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+    if by_date is None:
+        by_date = index_by_date(history)
+    return _score(history, by_date, day or date.today(), user_id)[1]
+
+def compute_life_score(entry_date: date, history: List[Dict[str, Any]],
+                       by_date: Optional[Dict[date, Dict[str, Any]]] = None,
+                       user_id: Optional[int] = None) -> Dict[str, Any]:
+    # Use entry_date and the 2 days before it
+    if by_date is None:
+        by_date = index_by_date(history)
+    life_raw, stability, mood, m_eff, m_hat = _score(history, by_date, entry_date, user_id)
     life_score = round(100 * life_raw)
     # qualitative
     if life_score < 50:
@@ -212,17 +295,34 @@ def compute_life_score(entry_date: str, history: List[Dict[str, Any]]) -> Dict[s
         "stability": stability
     }
 
+def cached_life_score(user_id: int, entry_date: date, history: List[Dict[str, Any]],
+                      by_date: Optional[Dict[date, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    key = (user_id, entry_date) + history_fingerprint(history)
+    return _memo(_SCORE_CACHE, key, SCORE_CACHE_SIZE,
+                 lambda: compute_life_score(entry_date, history, by_date, user_id))
+
+def week_scores(user_id: int, history: List[Dict[str, Any]], today: date) -> List[int]:
+    # daily scores for the last 7 days that have an entry
+    by_date = index_by_date(history)
+    scores = []
+    for day in _recent_dates(today, 7):
+        if day in by_date:
+            res = cached_life_score(user_id, day, history, by_date)
+            scores.append(res["life_score"])
+    return scores
+
 # --------------- Telegram Bot ---------------
 ASK_MOOD, ASK_SLEEP, ASK_ACTIVITY, ASK_FOCUS, ASK_SOCIAL, CONFIRM = range(6)
 
+FACTOR_NAMES = {
+    "sleep": "сон",
+    "activity": "активність",
+    "focus": "фокус",
+    "social": "соціум"
+}
+
 def fmt_optimal_line(k: str, opt: float, tol: float) -> str:
-    name = {
-        "sleep": "сон",
-        "activity": "активність",
-        "focus": "фокус",
-        "social": "соціум"
-    }[k]
-    return f"• {name}: оптимум ≈ {opt:.1f}, толеранс ±{tol:.1f}"
+    return f"• {FACTOR_NAMES[k]}: оптимум ≈ {opt:.1f}, толеранс ±{tol:.1f}"
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text(
@@ -309,23 +409,25 @@ async def finalize_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     context.user_data["social"] = social
 
     user_id = update.effective_user.id
-    data = load_user(user_id)
-    entry = get_entry(data["entries"], today_str())
+    now = datetime.now()
+    today = now.date()
+    data = await asyncio.to_thread(load_user, user_id)
+    entry = get_entry(data["entries"], today)
     entry.update({
         "mood": int(context.user_data["mood"]),
         "sleep": float(context.user_data["sleep"]),
         "activity": float(context.user_data["activity"]),
         "focus": float(context.user_data["focus"]),
         "social": float(context.user_data["social"]),
-        "ts": datetime.now().isoformat(timespec="seconds")
+        "ts": now.isoformat(timespec="seconds")
     })
-    save_user(user_id, data)
+    await asyncio.to_thread(save_user, user_id, data)
 
-    # Compute score immediately
-    res = compute_life_score(today_str(), data["entries"])
+    # Compute score immediately (off the event loop)
+    res = await asyncio.to_thread(cached_life_score, user_id, today, data["entries"])
 
     lines = [
-        f"✅ Запис збережено ({today_str()}).",
+        f"✅ Запис збережено ({today}).",
         f"Life Score: {res['life_score']} {res['band']}",
         f"Mood (ядро): {res['mood']*100:.0f} (m_eff={res['m_eff']*100:.0f}, m_hat={res['m_hat']*100:.0f})",
         f"Stability: {res['stability']['value']*100:.0f}",
@@ -344,11 +446,12 @@ async def finalize_log(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 
 async def score_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    data = load_user(user_id)
-    if not data["entries"] or data["entries"][-1]["date"] != today_str():
+    data = await asyncio.to_thread(load_user, user_id)
+    today = date.today()
+    if not data["entries"] or data["entries"][-1]["_date"] != today:
         await update.message.reply_text("Немає сьогоднішнього запису. Натисни /log.")
         return
-    res = compute_life_score(today_str(), data["entries"])
+    res = await asyncio.to_thread(cached_life_score, user_id, today, data["entries"])
     await update.message.reply_text(
         f"Life Score: {res['life_score']} {res['band']}\n"
         f"Mood (ядро): {res['mood']*100:.0f}\n"
@@ -357,17 +460,12 @@ async def score_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def week_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    data = load_user(user_id)
+    data = await asyncio.to_thread(load_user, user_id)
     if not data["entries"]:
         await update.message.reply_text("Немає даних. Почни з /log.")
         return
     # compute daily scores for last 7 days (if entries exist)
-    scores = []
-    for d in range(7):
-        ds = (datetime.now() - timedelta(days=d)).strftime("%Y-%m-%d")
-        if any(e["date"] == ds for e in data["entries"]):
-            res = compute_life_score(ds, data["entries"])
-            scores.append(res["life_score"])
+    scores = await asyncio.to_thread(week_scores, user_id, data["entries"], date.today())
     if not scores:
         await update.message.reply_text("Немає достатньо даних за останні 7 днів.")
         return
@@ -376,15 +474,14 @@ async def week_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    data = load_user(user_id)
-    payload = json.dumps(data, ensure_ascii=False, indent=2)
-    # send as code block (small data) or as file if large
+    data = await asyncio.to_thread(load_user, user_id)
+    raw = dump_user(data)
+    payload = raw.decode()
+    # send as <pre> block (small data) or as in-memory file if large
     if len(payload) < 3500:
-        await update.message.reply_text(f"```\n{payload}\n```", parse_mode="MarkdownV2")
+        await update.message.reply_text(f"<pre>{html.escape(payload, quote=False)}</pre>", parse_mode="HTML")
     else:
-        p = DATA_DIR / f"export_{user_id}.json"
-        p.write_text(payload)
-        await update.message.reply_document(document=str(p), filename=p.name)
+        await update.message.reply_document(document=io.BytesIO(raw), filename=f"export_{user_id}.json")
 
 def build_app(token: str):
     app = ApplicationBuilder().token(token).build()
@@ -414,6 +511,8 @@ def main():
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
         raise RuntimeError("Please set TELEGRAM_BOT_TOKEN in .env")
+    # one-time split of the old shared logs.csv into per-user logs
+    migrate_legacy_log()
     app = build_app(token)
     print("Axis bot is running. Press Ctrl+C to stop.")
     app.run_polling()
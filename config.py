@@ -0,0 +1,7 @@
+# config.py
+import os
+from pathlib import Path
+
+# === Спільна директорія даних для axis_bot і sweet_spots (працює локально і на Render) ===
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+DATA_DIR.mkdir(parents=True, exist_ok=True)
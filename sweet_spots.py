@@ -1,16 +1,26 @@
 # sweet_spots.py
-import pandas as pd
 from datetime import datetime
+import atexit
+import csv
 import json
 import os
 import logging
-from pathlib import Path
+import threading
 
-# === Налаштування збереження файлів (працює локально і на Render) ===
-DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-LOG_FILE = str(DATA_DIR / "logs.csv")
+import numpy as np
+
+from config import DATA_DIR
+
+# === Налаштування збереження файлів (DATA_DIR спільний з axis_bot, див. config.py) ===
+LOG_DIR = DATA_DIR / "logs"  # один CSV на користувача: logs/<user_id>.csv
+LOG_DIR.mkdir(parents=True, exist_ok=True)
+LEGACY_LOG_FILE = str(DATA_DIR / "logs.csv")  # старий спільний лог усіх користувачів
 SWEET_FILE = str(DATA_DIR / "sweet_spots.json")
+# службовий ключ у sweet_spots.json: {user_id: [кількість рядків логу, розмір файлу в байтах]};
+# лічильнику віримо лише поки розмір файлу збігається (інакше він міг відстати після збою)
+COUNTS_KEY = "_counts"
+MIN_LOGS = 10  # мінімум записів для оновлення sweet spots
+LOG_COLUMNS = ["user_id", "date", "mood", "sleep", "activity", "focus", "social"]
 
 # === Логування в консоль (видно в Render Logs) ===
 logging.basicConfig(
@@ -19,56 +29,191 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+# === КЕШ ЛОГІВ У ПАМ'ЯТІ (CSV користувача читається лише коли файл змінився ззовні) ===
+_LOG_CACHE = {}  # user_id -> {"key": (mtime_ns, size), "rows": [...]}
+
+def _log_path(uid):
+    return str(LOG_DIR / f"{uid}.csv")
+
+def _log_file_key(path):
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def _parse_log_row(row):
+    return {
+        "user_id": row["user_id"],
+        "date": row["date"],
+        "mood": float(row["mood"]),
+        "sleep": float(row["sleep"]),
+        "activity": float(row["activity"]),
+        "focus": float(row["focus"]),
+        "social": float(row["social"])
+    }
+
+def _get_user_rows(uid):
+    path = _log_path(uid)
+    if not os.path.exists(path):
+        return []
+    key = _log_file_key(path)
+    cached = _LOG_CACHE.get(uid)
+    if cached is None or cached["key"] != key:
+        with open(path, newline="") as f:
+            rows = [_parse_log_row(row) for row in csv.DictReader(f)]
+        cached = _LOG_CACHE[uid] = {"key": key, "rows": rows}
+    return cached["rows"]
+
+def _append_rows(path, rows):
+    is_new = not os.path.exists(path)
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f)
+        if is_new:
+            writer.writerow(LOG_COLUMNS)
+        for row in rows:
+            writer.writerow([row[c] for c in LOG_COLUMNS])
+
+def migrate_legacy_log():
+    # розкладаємо старий спільний logs.csv по файлах користувачів; безпечно запускати повторно
+    if not os.path.exists(LEGACY_LOG_FILE):
+        return
+    by_user = {}
+    with open(LEGACY_LOG_FILE, newline="") as f:
+        for row in csv.DictReader(f):
+            by_user.setdefault(row["user_id"], []).append(row)
+    migrated = 0
+    for uid, rows in by_user.items():
+        path = _log_path(uid)
+        # файл уже є (попередній запуск або нові записи) — не дублюємо рядки
+        if os.path.exists(path):
+            logging.warning(f"[{uid}] {path} already exists; skip legacy rows for this user.")
+            continue
+        # пишемо у тимчасовий файл і атомарно підміняємо — без напівзаписаних логів після збою
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        _append_rows(tmp, rows)
+        os.replace(tmp, path)
+        migrated += 1
+    os.replace(LEGACY_LOG_FILE, LEGACY_LOG_FILE + ".migrated")
+    logging.info(f"Split {LEGACY_LOG_FILE} into {migrated} per-user logs in {LOG_DIR}.")
+
 # === ЗБЕРЕЖЕННЯ ЩОДЕННОГО ЛОГУ КОРИСТУВАЧА ===
 def save_log(user_id, mood, sleep, activity, focus, social):
-    new_data = pd.DataFrame([{
-        "user_id": str(user_id),
+    uid = str(user_id)
+    row = {
+        "user_id": uid,
         "date": datetime.now().strftime("%Y-%m-%d"),
         "mood": float(mood),
         "sleep": float(sleep),
         "activity": float(activity),
         "focus": float(focus),
         "social": float(social)
-    }])
+    }
+
+    # дописуємо один рядок у кінець файлу користувача замість перезапису всього логу
+    path = _log_path(uid)
+    cached = _LOG_CACHE.get(uid)
+    is_new = not os.path.exists(path)
+    size_before = 0 if is_new else os.path.getsize(path)
+    if is_new:
+        cached = _LOG_CACHE[uid] = {"key": None, "rows": []}
+    elif cached is not None and cached["key"] != _log_file_key(path):
+        cached = None
+    _append_rows(path, [row])
+    size_after = os.path.getsize(path)
 
-    if os.path.exists(LOG_FILE):
-        df = pd.read_csv(LOG_FILE)
-        df = pd.concat([df, new_data], ignore_index=True)
-    else:
-        df = new_data
+    # кеш був актуальним — просто додаємо рядок, без повторного читання файлу
+    if cached is not None:
+        cached["rows"].append(row)
+        cached["key"] = _log_file_key(path)
 
-    df.to_csv(LOG_FILE, index=False)
+    # лічильник рядків користувача (для раннього виходу в recalculate_all_sweet_spots);
+    # якщо він невідомий або не відповідає файлу — його перерахує recalculate
+    with _SPOTS_LOCK:
+        spots = _load_sweet_spots()
+        counts = spots.setdefault(COUNTS_KEY, {})
+        known = counts.get(uid)
+        if is_new:
+            counts[uid] = [1, size_after]
+        elif isinstance(known, list) and known[1] == size_before:
+            counts[uid] = [known[0] + 1, size_after]
+        else:
+            counts.pop(uid, None)
+        _save_sweet_spots(spots)
     logging.info(f"[{user_id}] Logged entry: mood={mood}, sleep={sleep}, activity={activity}, focus={focus}, social={social}")
 
 # === ДОСТУП ДО ІСТОРІЇ ТА ПОТОЧНИХ SWEET SPOTS ===
 def get_user_logs(user_id):
-    if not os.path.exists(LOG_FILE):
+    if not os.path.exists(_log_path(str(user_id))):
         return None
-    df = pd.read_csv(LOG_FILE)
-    return df[df['user_id'] == str(user_id)]
+    return list(_get_user_rows(str(user_id)))
+
+# === SWEET SPOTS У ПАМ'ЯТІ + ВІДКЛАДЕНИЙ ЗАПИС НА ДИСК ===
+FLUSH_DELAY = 2.0  # секунд між зміною і записом sweet_spots.json
+_SPOTS_CACHE = {"data": None, "dirty": False, "timer": None}
+# будь-яка зміна кешованого dict — лише під цим замком (таймер серіалізує його з іншого потоку)
+_SPOTS_LOCK = threading.RLock()
+# послідовний запис файлу (таймер і atexit можуть збігтися); не тримається разом із _SPOTS_LOCK
+_FLUSH_LOCK = threading.Lock()
 
 def _load_sweet_spots():
-    if os.path.exists(SWEET_FILE):
-        with open(SWEET_FILE, "r") as f:
-            return json.load(f)
-    return {}
+    # файл читається лише один раз за життя процесу
+    with _SPOTS_LOCK:
+        if _SPOTS_CACHE["data"] is None:
+            if os.path.exists(SWEET_FILE):
+                with open(SWEET_FILE, "r") as f:
+                    _SPOTS_CACHE["data"] = json.load(f)
+            else:
+                _SPOTS_CACHE["data"] = {}
+        return _SPOTS_CACHE["data"]
 
 def _save_sweet_spots(data):
-    with open(SWEET_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    # позначаємо кеш «брудним»; кілька змін поспіль дають один запис файлу
+    with _SPOTS_LOCK:
+        _SPOTS_CACHE["data"] = data
+        _SPOTS_CACHE["dirty"] = True
+        if _SPOTS_CACHE["timer"] is None:
+            timer = threading.Timer(FLUSH_DELAY, flush_sweet_spots)
+            timer.daemon = True
+            timer.start()
+            _SPOTS_CACHE["timer"] = timer
+
+def flush_sweet_spots():
+    with _FLUSH_LOCK:
+        # знімок під замком, запис на диск — уже без нього
+        with _SPOTS_LOCK:
+            _SPOTS_CACHE["timer"] = None
+            if not _SPOTS_CACHE["dirty"]:
+                return
+            snapshot = {k: dict(v) for k, v in _SPOTS_CACHE["data"].items()}
+            _SPOTS_CACHE["dirty"] = False
+        # тимчасовий файл + os.replace: sweet_spots.json ніколи не буває записаним наполовину
+        tmp = SWEET_FILE + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(snapshot, f, indent=2)
+            os.replace(tmp, SWEET_FILE)
+        except OSError:
+            with _SPOTS_LOCK:
+                _SPOTS_CACHE["dirty"] = True
+            raise
+
+# незбережені зміни потрапляють на диск при нормальному завершенні (Ctrl+C / SIGTERM у run_polling)
+atexit.register(flush_sweet_spots)
 
 def get_sweet_spots(user_id):
-    data = _load_sweet_spots()
-    return data.get(str(user_id))
+    with _SPOTS_LOCK:
+        spots = _load_sweet_spots().get(str(user_id))
+        return dict(spots) if spots is not None else None
 
 # === АНАЛІТИКА: ПОШУК ОПТИМУМУ ТА ОНОВЛЕННЯ SWEET SPOTS ===
-def find_optimal_sweet_spot(df, factor):
-    # середній настрій для кожного значення фактора
-    grouped = df.groupby(factor)['mood'].mean()
-    # якщо даних замало або NaN — повертаємо поточне середнє
-    if grouped.empty:
-        return float(df[factor].mean())
-    return float(grouped.idxmax())
+def find_optimal_sweet_spot(entries, factor):
+    # середній настрій для кожного значення фактора (групування через bincount)
+    vals = np.fromiter((e[factor] for e in entries), dtype=np.float64, count=len(entries))
+    moods = np.fromiter((e['mood'] for e in entries), dtype=np.float64, count=len(entries))
+    keys, groups = np.unique(vals, return_inverse=True)
+    means = np.bincount(groups, weights=moods) / np.bincount(groups)
+    # argmax бере перше входження, тобто при однаковому середньому — менше значення фактора
+    return float(keys[np.argmax(means)])
 
 def update_sweet_spot(old, optimal, alpha=0.3):
     return float(old) * (1 - alpha) + float(optimal) * alpha
@@ -77,15 +222,35 @@ def apply_tolerance(value, min_val, max_val):
     return max(min_val, min(max_val, value))
 
 def recalculate_all_sweet_spots(user_id):
-    if not os.path.exists(LOG_FILE):
+    uid = str(user_id)
+    path = _log_path(uid)
+    if not os.path.exists(path):
         logging.info(f"[{user_id}] No logs yet; skip sweet spot update.")
         return
 
-    df = pd.read_csv(LOG_FILE)
-    df = df[df['user_id'] == str(user_id)]
+    # швидкий вихід для нових користувачів — без читання CSV, якщо лічильник відповідає файлу
+    with _SPOTS_LOCK:
+        known = _load_sweet_spots().get(COUNTS_KEY, {}).get(uid)
+    if isinstance(known, list) and known[1] == os.path.getsize(path) and known[0] < MIN_LOGS:
+        logging.info(f"[{user_id}] Not enough data to update sweet spots ({known[0]}/{MIN_LOGS}).")
+        return
 
-    if len(df) < 10:
-        logging.info(f"[{user_id}] Not enough data to update sweet spots ({len(df)}/10).")
+    rows = _get_user_rows(uid)
+    # розмір файлу саме на момент читання цих рядків
+    size = _LOG_CACHE[uid]["key"][1]
+    with _SPOTS_LOCK:
+        sweet_spots = _load_sweet_spots()
+        sweet_spots.setdefault(COUNTS_KEY, {})[uid] = [len(rows), size]
+        # поточні sweet spots або дефолт
+        prev_spots = dict(sweet_spots.get(uid) or {
+            'sleep': 8.0,
+            'activity': 5.0,
+            'focus': 6.0,
+            'social': 3.0
+        })
+        _save_sweet_spots(sweet_spots)
+    if len(rows) < MIN_LOGS:
+        logging.info(f"[{user_id}] Not enough data to update sweet spots ({len(rows)}/{MIN_LOGS}).")
         return
 
     # здорові межі (запобігають сповзанню в шкідливу «норму»)
@@ -96,26 +261,18 @@ def recalculate_all_sweet_spots(user_id):
         'social': (0.0, 10.0)
     }
 
-    # поточні sweet spots або дефолт
-    sweet_spots = _load_sweet_spots()
-    uid = str(user_id)
-    if uid not in sweet_spots:
-        sweet_spots[uid] = {
-            'sleep': 8.0,
-            'activity': 5.0,
-            'focus': 6.0,
-            'social': 3.0
-        }
 
     new_spots = {}
     for factor in ['sleep', 'activity', 'focus', 'social']:
-        optimal = find_optimal_sweet_spot(df, factor)
-        prev = float(sweet_spots[uid][factor])
+        optimal = find_optimal_sweet_spot(rows, factor)
+        prev = float(prev_spots[factor])
         updated = update_sweet_spot(prev, optimal, alpha=0.3)
         bounded = apply_tolerance(updated, *tolerances[factor])
         new_spots[factor] = round(bounded, 2)
         logging.info(f"[{user_id}] {factor.capitalize()} sweet spot: {prev:.2f} → {new_spots[factor]:.2f} (optimal {optimal:.2f})")
 
-    sweet_spots[uid] = new_spots
-    _save_sweet_spots(sweet_spots)
+    with _SPOTS_LOCK:
+        sweet_spots = _load_sweet_spots()
+        sweet_spots[uid] = new_spots
+        _save_sweet_spots(sweet_spots)
     logging.info(f"[{user_id}] ✅ Sweet spots updated: {new_spots}")